@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import xml.etree.ElementTree as ET
 import pandas as pd
-from datetime import datetime, date
+import numpy as np
+from datetime import datetime
 import google.generativeai as genai
 import re # 正規表現のため
+import io
 import traceback # エラー詳細表示用
+from concurrent.futures import ThreadPoolExecutor, as_completed # 並列取得用
 
 # --- PAGE CONFIG (MUST BE FIRST ST COMMAND) ---
 st.set_page_config(page_title="e-Gov 法令検索 AI", layout="wide")
@@ -16,22 +21,47 @@ st.set_page_config(page_title="e-Gov 法令検索 AI", layout="wide")
 API_BASE_URL = "https://laws.e-gov.go.jp/api/1"
 EGOV_LAW_VIEW_URL = "https://elaws.e-gov.go.jp/document?lawid="
 
+# e-Gov への接続は keep-alive のセッションを使い回し、429/5xx は指数バックオフで再試行する
+# (読み取りタイムアウトは再試行しない。再試行が尽きた場合も最終レスポンスを返し、raise_for_status() で HTTPError にする)
+# (スクリプトは操作のたびに再実行されるため、cache_resource でプロセス内に一つだけ作る)
+@st.cache_resource
+def _get_http_session():
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=Retry(total=3, read=0, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=frozenset(["GET"]), raise_on_status=False)))
+    return session
+_SESSION = _get_http_session()
+
 LAW_TYPES = { "すべて (All)": "1", "憲法・法律 (Constitution/Law)": "2", "政令・勅令 (Cabinet/Imperial Order)": "3", "府省令・規則 (Ministerial Ordinance/Rule)": "4", }
 LAW_TYPES_REV = {v: k for k, v in LAW_TYPES.items()}
 SPECIFIC_LAW_TYPE_CODES = ['2', '3', '4']
-TYPE_SORT_ORDER = { '2': 1, '3': 2, '4': 3, }
+# 法令種別コードはカテゴリ型で保持し、カテゴリの並び順 (cat.codes) を種別ソートキーとして使う
+_TYPE_CODE_DTYPE = pd.CategoricalDtype(categories=SPECIFIC_LAW_TYPE_CODES, ordered=True)
+_LAW_TYPE_LABELS = [LAW_TYPES_REV[code] for code in SPECIFIC_LAW_TYPE_CODES]
 TYPE_SORT_KEY = "_type_sort_key"
 BASE_SORTABLE_COLUMNS = { "法令名 (Law Name)": "法令名 (Law Name)", "法令番号 (Law Number)": "法令番号 (Law Number)", "公布日 (Promulgation Date)": "公布日 (Promulgation Date)_dt", }
 DEFAULT_SPECIFIC_TYPE_SORT_COLUMN = "法令番号 (Law Number)"
 DEFAULT_SPECIFIC_TYPE_SORT_ASCENDING = True
 DEFAULT_ALL_TYPE_SORT_COLUMN = TYPE_SORT_KEY
 DEFAULT_ALL_TYPE_SORT_ASCENDING = True
+DISPLAY_ROW_FIELDS = { "LawId": "law_id", "法令名 (Law Name)": "law_name", "法令番号 (Law Number)": "law_no", "公布日 (Promulgation Date)": "date", "法令種別 (Law Type)": "law_type", }
+QA_HISTORY_TURNS = 5 # Gemini に送る質問応答履歴の最大往復数
+PREFETCH_TOP_N = 20 # AI ボタン押下前に本文を先読みしておく表示上位件数
+LAW_LIST_COLUMNS = [ "LawId", "法令名 (Law Name)", "法令番号 (Law Number)", "公布日 (Promulgation Date)_dt", "法令種別コード (Law Type Code)" ]
+
+# --- Precompiled Regexes ---
+_CITATION_BLOCK_RE = re.compile(r"【引用元:\s*(.+?)\s*】")
+_ARTICLE_TOKEN_RE = re.compile(r"第(?:[一二三四五六七八九十百千]+|[0-9]+)(?:条(?:の[一二三四五六七八九十百千]|[0-9]+)*)?")
+_WS_RE = re.compile(r"\s+")
 
 # --- Gemini Configuration ---
+@st.cache_resource
+def _get_gemini_model():
+    # API キー設定とモデル生成はプロセスごとに一度だけ行う (再実行のたびに作り直さない)
+    genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
+    return genai.GenerativeModel('gemini-1.5-flash') # Or 'gemini-1.5-pro-latest' if available
+
 try:
-    GEMINI_API_KEY = st.secrets["GEMINI_API_KEY"]
-    genai.configure(api_key=GEMINI_API_KEY)
-    gemini_model = genai.GenerativeModel('gemini-1.5-flash') # Or 'gemini-1.5-pro-latest' if available
+    gemini_model = _get_gemini_model()
     GEMINI_ENABLED = True
 except (KeyError, FileNotFoundError):
     st.warning("Gemini API Key not found in st.secrets. AI features disabled.", icon="⚠️")
@@ -42,107 +72,200 @@ except Exception as e:
 
 
 # --- API Helper Functions ---
-def parse_api_response(xml_text):
-    try:
-        if xml_text.startswith('\ufeff'): xml_text = xml_text[1:]
-        root = ET.fromstring(xml_text)
-        result_code_node = root.find("./Result/Code"); message_node = root.find("./Result/Message")
-        result_code = result_code_node.text if result_code_node is not None else "-1"
-        message = message_node.text if message_node is not None else "No message provided"
-        if result_code != "0": return None, result_code, message
-        app_data = root.find("./ApplData")
-        if app_data is None: return None, "0", "API returned success code 0 but no ApplData found."
-        return app_data, result_code, message
-    except ET.ParseError as e:
-        error_line = None; L = xml_text.splitlines()
-        if hasattr(e, 'position') and len(L) >= e.position[0]: error_line = L[e.position[0]-1]
-        return None, "-1", f"XML Parse Error: {e}. Near line {e.position[0] if hasattr(e,'position') else '?'}: '{error_line}'"
-    except Exception as e: return None, "-1", f"Unexpected parsing error: {e}"
+class _LawListCollector:
+    """XMLParser target that collects the law list into per-field lists without building a DOM."""
+    __slots__ = ("buf", "row", "in_result", "app_data_found", "result_code", "message", "ids", "names", "nos", "dates")
+    ROW_FIELDS = ("LawId", "LawName", "LawNo", "PromulgationDate")
+
+    def __init__(self):
+        self.buf = []; self.row = None; self.in_result = False; self.app_data_found = False
+        self.result_code = "-1"; self.message = "No message provided"
+        self.ids = []; self.names = []; self.nos = []; self.dates = []
+
+    def start(self, tag, attrib):
+        self.buf = []
+        if tag == "LawNameListInfo": self.row = dict.fromkeys(self.ROW_FIELDS)
+        elif tag == "Result": self.in_result = True
+        elif tag == "ApplData": self.app_data_found = True
+
+    def data(self, data): self.buf.append(data)
+
+    def end(self, tag):
+        text = "".join(self.buf); self.buf = []
+        if self.row is not None:
+            if tag == "LawNameListInfo":
+                row = self.row; self.row = None
+                self.ids.append(row["LawId"]); self.names.append(row["LawName"]); self.nos.append(row["LawNo"]); self.dates.append(row["PromulgationDate"])
+            elif tag in self.row: self.row[tag] = text
+        elif self.in_result:
+            if tag == "Code": self.result_code = text
+            elif tag == "Message": self.message = text
+            elif tag == "Result": self.in_result = False
 
+    def close(self): return self
+
+def new_law_columns():
+    return {col: [] for col in LAW_LIST_COLUMNS}
+
+def count_laws(laws):
+    return len(laws["LawId"]) if laws else 0
+
+class _LawListApiError(Exception):
+    """Raised when the e-Gov law list API answers with a non-success result."""
+
+@st.cache_data(ttl=3600, show_spinner=False)
 def _fetch_specific_type(law_type_code):
-    url = f"{API_BASE_URL}/lawlists/{law_type_code}"; laws = []
-    try:
-        response = requests.get(url, timeout=30); response.raise_for_status()
-        response.encoding = response.apparent_encoding or 'utf-8'
-        app_data, result_code, message = parse_api_response(response.text)
-        if app_data is None: st.error(f"法令種別 {law_type_code} のリスト取得APIエラー (Code: {result_code}): {message}"); return []
-        for list_info in app_data.findall("./LawNameListInfo"):
-            law_id = list_info.findtext("LawId"); law_name = list_info.findtext("LawName"); law_no = list_info.findtext("LawNo")
-            promulgation_date_str = list_info.findtext("PromulgationDate"); promulgation_date_obj = None
-            if promulgation_date_str:
-                 try: promulgation_date_obj = datetime.strptime(promulgation_date_str, "%Y%m%d").date()
-                 except (ValueError, TypeError): promulgation_date_obj = None
-            laws.append({ "LawId": law_id, "法令名 (Law Name)": law_name, "法令番号 (Law Number)": law_no, "公布日 (Promulgation Date)_dt": promulgation_date_obj, "法令種別コード (Law Type Code)": law_type_code, TYPE_SORT_KEY: TYPE_SORT_ORDER.get(law_type_code, 99) })
-        return laws
-    except requests.exceptions.RequestException as e: st.error(f"ネットワークエラー (法令種別 {law_type_code}): {e}"); return []
-    except Exception as e: st.error(f"予期せぬエラー (法令種別 {law_type_code}): {e}"); return []
+    # ワーカースレッドから呼ばれるため Streamlit API は使わない。失敗時は例外を送出する (st.cache_data は例外をキャッシュしないため、成功結果だけが残る)
+    # 法令リストは列ごとのリスト (dict of lists) として保持し、DataFrame 化は filter_laws で一度だけ行う
+    url = f"{API_BASE_URL}/lawlists/{law_type_code}"
+    response = _SESSION.get(url, timeout=30); response.raise_for_status()
+    parser = ET.XMLParser(target=_LawListCollector()); parser.feed(response.content); collector = parser.close() # bytes のまま解析 (文字コード推定を避ける)
+    if collector.result_code != "0": raise _LawListApiError(collector.result_code, collector.message)
+    if not collector.app_data_found: raise _LawListApiError("0", "API returned success code 0 but no ApplData found.")
+    # 公布日は YYYYMMDD 文字列のまま保持し、filter_laws で pd.to_datetime により一括変換する
+    laws = { "LawId": collector.ids, "法令名 (Law Name)": collector.names, "法令番号 (Law Number)": collector.nos, "公布日 (Promulgation Date)_dt": collector.dates }
+    laws["法令種別コード (Law Type Code)"] = [law_type_code] * len(laws["LawId"])
+    return laws
+
+def _describe_fetch_error(law_type_code, e):
+    if isinstance(e, _LawListApiError): return f"法令種別 {law_type_code} のリスト取得APIエラー (Code: {e.args[0]}): {e.args[1]}"
+    if isinstance(e, ET.ParseError): return f"法令種別 {law_type_code} のリスト取得APIエラー (Code: -1): XML Parse Error: {e}"
+    if isinstance(e, requests.exceptions.RequestException): return f"ネットワークエラー (法令種別 {law_type_code}): {e}"
+    return f"予期せぬエラー (法令種別 {law_type_code}): {e}"
 
 def fetch_law_list(requested_law_type_code):
-    all_laws = []
+    all_laws = new_law_columns()
     if requested_law_type_code == '1':
-        st.write("「すべて」を選択したため、種別ごとにリストを取得します...")
+        st.write("「すべて」を選択したため、種別ごとにリストを並列取得します...")
         progress_bar = st.progress(0.0); num_types = len(SPECIFIC_LAW_TYPE_CODES); fetch_errors = False
-        for i, code in enumerate(SPECIFIC_LAW_TYPE_CODES):
-            st.write(f"- {LAW_TYPES_REV.get(code, code)} を取得中..."); laws_for_type = _fetch_specific_type(code)
-            if not laws_for_type: fetch_errors = True
-            all_laws.extend(laws_for_type); progress_bar.progress((i + 1) / num_types)
+        with ThreadPoolExecutor(max_workers=num_types) as executor:
+            futures = {executor.submit(_fetch_specific_type, code): code for code in SPECIFIC_LAW_TYPE_CODES}
+            for i, future in enumerate(as_completed(futures)):
+                code = futures[future]
+                try: laws_for_type = future.result()
+                except Exception as e: st.error(_describe_fetch_error(code, e)); laws_for_type = new_law_columns()
+                if not count_laws(laws_for_type): fetch_errors = True
+                else: st.write(f"- {LAW_TYPES_REV.get(code, code)} を取得しました ({count_laws(laws_for_type)} 件)")
+                for col in LAW_LIST_COLUMNS: all_laws[col].extend(laws_for_type[col])
+                progress_bar.progress((i + 1) / num_types)
         progress_bar.empty()
-        if not all_laws and fetch_errors: st.error("すべての法令種別の取得に失敗しました。"); return None
+        if not count_laws(all_laws) and fetch_errors: st.error("すべての法令種別の取得に失敗しました。"); return None
         elif fetch_errors: st.warning("一部の法令種別の取得中にエラーが発生しました。")
         st.write("リストの結合完了。"); return all_laws
     elif requested_law_type_code in SPECIFIC_LAW_TYPE_CODES:
-        laws = _fetch_specific_type(requested_law_type_code)
-        if not laws: return None; return laws
+        try: laws = _fetch_specific_type(requested_law_type_code)
+        except Exception as e: st.error(_describe_fetch_error(requested_law_type_code, e)); return None
+        if not count_laws(laws): return None
+        return laws
     else: st.error(f"無効な法令種別コード: {requested_law_type_code}"); return None
 
-@st.cache_data(ttl=3600)
-def fetch_law_data_for_ai(law_id):
-    if not law_id: return None, "Error: Law ID required."
+def _download_law_data(law_id):
+    # 先読みのワーカースレッドからも呼ばれるため Streamlit API は使わない。戻り値は (text, error, used_fallback)
+    if not law_id: return None, "Error: Law ID required.", False
     url = f"{API_BASE_URL}/lawdata/{law_id}"
     try:
-        response = requests.get(url, timeout=60); response.raise_for_status()
-        response.encoding = response.apparent_encoding or 'utf-8'; xml_content = response.text
-        app_data, result_code, message = parse_api_response(xml_content)
-        if result_code != "0": return None, f"API Error (Code: {result_code}) fetching law data for {law_id}: {message}"
-        if app_data is None: return None, f"API Error: No ApplData found despite success code for {law_id}."
+        response = _SESSION.get(url, timeout=60); response.raise_for_status()
+        MAX_CHARS = 30000
         relevant_tags = {"LawTitle","ArticleTitle","ParagraphSentence","ItemSentence","Subitem1Sentence","Subitem2Sentence","SupplProvisionLabel","SupplProvisionSentence","Sentence"}
-        extracted_texts = [];
-        for element in app_data.iter():
-            if element.tag in relevant_tags and element.text:
-                text = element.text.strip();
-                if text: extracted_texts.append(text)
+        # DOM を構築せずストリーミングで解析し、処理済みの要素は clear() で解放する
+        result_code = None; message = None; app_data_found = False; fallback_text = None; extracted_texts = []; extracted_chars = 0
+        try:
+            for event, elem in ET.iterparse(io.BytesIO(response.content), events=("start", "end")):
+                tag = elem.tag
+                if event == "start":
+                    if tag == "ApplData":
+                        app_data_found = True
+                        if (result_code or "-1") != "0": break # ApplData の前に Result が来るので失敗時はここで打ち切る
+                    continue
+                if not app_data_found:
+                    if tag == "Code": result_code = elem.text
+                    elif tag == "Message": message = elem.text
+                    continue
+                if tag in relevant_tags and elem.text:
+                    text = _WS_RE.sub(' ', elem.text).strip() # 要素ごとに空白を正規化し、全文の再走査を避ける
+                    if text:
+                        extracted_texts.append(text); extracted_chars += len(text) + 1
+                        if extracted_chars > MAX_CHARS: break # 結合後の長さ (= extracted_chars - 1) が上限に達したら残りは解析しない
+                elif tag == "LawFullText": fallback_text = elem.text
+                elem.clear()
+        except ET.ParseError as e: return None, f"API Error (Code: -1) fetching law data for {law_id}: XML Parse Error: {e}", False
+        result_code = result_code or "-1"; message = message or "No message provided"
+        if result_code != "0": return None, f"API Error (Code: {result_code}) fetching law data for {law_id}: {message}", False
+        if not app_data_found: return None, f"API Error: No ApplData found despite success code for {law_id}.", False
         if not extracted_texts:
-            fallback_node = app_data.find("./LawFullText")
-            if fallback_node is not None and fallback_node.text and fallback_node.text.strip():
-                 st.warning(f"Could not extract structured text for {law_id}, using LawFullText fallback.")
-                 raw_text = fallback_node.text; cleaned_text = re.sub(r'\s+', ' ', raw_text).strip()
-                 return cleaned_text, None
-            else: return None, f"Failed to extract any relevant text content from XML structure for {law_id}."
-        combined_text = "\n".join(extracted_texts)
-        cleaned_text = re.sub(r'\s+', ' ', combined_text).strip()
-        MAX_CHARS = 30000
-        if not cleaned_text: return None, f"Extracted text for {law_id} became empty after cleaning."
-        return cleaned_text[:MAX_CHARS], None
+            if fallback_text and fallback_text.strip():
+                 raw_text = fallback_text; cleaned_text = _WS_RE.sub(' ', raw_text).strip()
+                 return cleaned_text, None, True # LawFullText で代用したことは呼び出し側で表示する
+            else: return None, f"Failed to extract any relevant text content from XML structure for {law_id}.", False
+        cleaned_text = ' '.join(extracted_texts)
+        if not cleaned_text: return None, f"Extracted text for {law_id} became empty after cleaning.", False
+        return cleaned_text[:MAX_CHARS], None, False
     except requests.exceptions.HTTPError as e:
          status_code = e.response.status_code
-         if status_code == 404: return None, f"指定された法令ID {law_id} が見つかりません (HTTP 404)。"
-         elif status_code == 406: return None, f"法令ID {law_id} のデータ取得で問題が発生しました (HTTP 406)。"
-         else: return None, f"HTTP Error {status_code} fetching law details for {law_id}."
-    except requests.exceptions.RequestException as e: return None, f"Network Error fetching law details for {law_id}: {e}"
-    except Exception as e: return None, f"Unexpected error processing law details for {law_id}: {e}"
+         if status_code == 404: return None, f"指定された法令ID {law_id} が見つかりません (HTTP 404)。", False
+         elif status_code == 406: return None, f"法令ID {law_id} のデータ取得で問題が発生しました (HTTP 406)。", False
+         else: return None, f"HTTP Error {status_code} fetching law details for {law_id}.", False
+    except requests.exceptions.RequestException as e: return None, f"Network Error fetching law details for {law_id}: {e}", False
+    except Exception as e: return None, f"Unexpected error processing law details for {law_id}: {e}", False
+
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False) # 多数の法令を閲覧してもキャッシュが際限なく増えないよう LRU で上限を設ける
+def fetch_law_data_for_ai(law_id):
+    return _download_law_data(law_id)
+
+def get_law_text_cached(law_id):
+    """Returns the law text via a per-session cache so summary and Q&A fetch it only once."""
+    key = f"law_text::{law_id}"
+    if key in st.session_state: return st.session_state[key], None
+    future = st.session_state.prefetched_law_data.pop(law_id, None)
+    # キュー待ちの先読みは共有プールの後ろに並んでいるため、取り消せた場合は直接取得する (完了済み・実行中のものだけ使う)
+    if future is not None and not (future.done() or future.running()) and future.cancel(): future = None
+    law_text, error, used_fallback = future.result() if future is not None else (None, None, False)
+    if future is None or error: law_text, error, used_fallback = fetch_law_data_for_ai(law_id) # 先読みが無い・失敗した場合は通常の取得
+    if used_fallback: st.warning(f"Could not extract structured text for {law_id}, using LawFullText fallback.")
+    if law_text: st.session_state[key] = law_text
+    return law_text, error
+
+@st.cache_resource
+def _get_prefetch_pool():
+    return ThreadPoolExecutor(max_workers=4)
+
+def cancel_prefetches(keep_law_ids=()):
+    """Cancels and drops prefetches for laws not in keep_law_ids."""
+    prefetched = st.session_state.prefetched_law_data
+    for law_id in [lid for lid in prefetched if lid not in keep_law_ids]: prefetched.pop(law_id).cancel()
+
+def prefetch_law_data(law_ids):
+    """Downloads law texts for law_ids in the background; get_law_text_cached picks up the results."""
+    cancel_prefetches(set(law_ids)) # 現在の上位行以外の先読みは破棄し、共有プールを空ける
+    prefetched = st.session_state.prefetched_law_data; pool = _get_prefetch_pool()
+    for law_id in law_ids:
+        if law_id in prefetched or f"law_text::{law_id}" in st.session_state: continue
+        prefetched[law_id] = pool.submit(_download_law_data, law_id) # ワーカーでは Streamlit API を呼ばない関数だけを実行する
 
 
 # --- Gemini Interaction Functions ---
+def _stream_response_text(response, placeholder=None):
+    """Accumulates streamed chunk text, rendering progress into the placeholder if given."""
+    accumulated = ""
+    for chunk in response:
+        if not chunk.parts: continue # ブロックされたチャンクは .text で例外になるためスキップ
+        accumulated += chunk.text
+        if placeholder is not None: placeholder.markdown(accumulated + "▌")
+    if placeholder is not None and accumulated: placeholder.markdown(accumulated)
+    return accumulated
+
 # ★★★ get_gemini_summary 関数の定義 ★★★
-def get_gemini_summary(text_content):
-    """Gets a summary from Gemini."""
+def get_gemini_summary(text_content, placeholder=None):
+    """Gets a summary from Gemini, streaming it into the placeholder if given."""
     if not GEMINI_ENABLED: return "AI機能は無効です。"
     if not text_content: return "要約対象のテキストがありません。"
     try:
         prompt = f"""以下の日本の法令本文を200〜300字程度で簡潔に要約してください。\n\n--- 法令本文 ---\n{text_content}\n--- ここまで ---\n\n--- 要約 ---"""
-        response = gemini_model.generate_content(prompt)
-        if response.parts:
-             return response.text
+        response = gemini_model.generate_content(prompt, stream=True)
+        summary_text = _stream_response_text(response, placeholder)
+        if summary_text:
+             return summary_text
         else:
              # 詳細なエラー情報を取得しようと試みる
              try:
@@ -160,23 +283,33 @@ def get_gemini_summary(text_content):
         st.code(traceback.format_exc()) # トレースバックを表示
         return "要約の生成中に予期せぬエラーが発生しました。"
 
-def get_gemini_chat_response(context, history, user_question):
+def get_gemini_chat_response(context, history, user_question, placeholder=None):
     if not GEMINI_ENABLED: return "AI機能は無効です。"
     if not context: return "チャットのコンテキスト（法令本文）がありません。"
-    gemini_history = [{"role": ("user" if entry["role"] == "user" else "model"), "parts": [entry["content"]]} for entry in history]
-    system_instruction = f"""あなたは日本の法律アシスタントAIです。提供された以下の法令本文に基づいて、ユーザーの質問にのみ回答してください。本文から回答が見つからない場合は「提供された本文からは回答できません。」と明確に述べてください。外部知識や推測は使用しないでください。回答は簡潔にお願いします。
+    # 法令本文を含むチャットセッションは Q&A ごとに一度だけ作り、以降のターンでは使い回す
+    chat_session = st.session_state.qa_chat_session
+    if chat_session is None:
+        system_instruction = f"""あなたは日本の法律アシスタントAIです。提供された以下の法令本文に基づいて、ユーザーの質問にのみ回答してください。本文から回答が見つからない場合は「提供された本文からは回答できません。」と明確に述べてください。外部知識や推測は使用しないでください。回答は簡潔にお願いします。
 **重要:** 回答を作成した後、その回答の主な根拠となった条文番号を、回答の最後に `【引用元: 第〇条】` または `【引用元: 第〇条、第△条】` の形式で**必ず**示してください。該当する条文がない場合は `【引用元: なし】` と記載してください。
 
 --- 法令本文 ---
 {context}
 --- ここまで ---
 """
-    messages_for_api = [{"role": "user", "parts": [system_instruction]}, {"role": "model", "parts": ["承知いたしました。提供された法令本文に基づいて回答し、引用元を示します。"]}]
-    messages_for_api.extend(gemini_history)
-    messages_for_api.append({"role": "user", "parts": [user_question]})
+        gemini_history = [{"role": ("user" if entry["role"] == "user" else "model"), "parts": [entry["content"]]} for entry in history[-2 * QA_HISTORY_TURNS:]]
+        chat_session = gemini_model.start_chat(history=[{"role": "user", "parts": [system_instruction]}, {"role": "model", "parts": ["承知いたしました。提供された法令本文に基づいて回答し、引用元を示します。"]}] + gemini_history)
+        st.session_state.qa_chat_session = chat_session
+    reason = None
     try:
-        response = gemini_model.generate_content(messages_for_api)
-        if response.parts: return response.text
+        # 送信する履歴は冒頭の指示 (法令本文) と直近 QA_HISTORY_TURNS 往復のみに制限する
+        if len(chat_session.history) > 2 + 2 * QA_HISTORY_TURNS: chat_session.history = chat_session.history[:2] + chat_session.history[-2 * QA_HISTORY_TURNS:]
+        response = chat_session.send_message(user_question, stream=True)
+        response_text = _stream_response_text(response, placeholder)
+        finish_reason = response.candidates[0].finish_reason if response.candidates else None
+        if finish_reason not in (genai.types.FinishReason.STOP, genai.types.FinishReason.MAX_TOKENS):
+            # 途中で打ち切られた応答が残ると次のターンで history が BrokenResponseError になるため、セッションを破棄して履歴から作り直す
+            st.session_state.qa_chat_session = None
+        if response_text: return response_text
         else:
              try:
                  reason = response.candidates[0].finish_reason if response.candidates else "Unknown"
@@ -189,7 +322,19 @@ def get_gemini_chat_response(context, history, user_question):
              if reason == genai.types.FinishReason.SAFETY: return "回答が安全基準によりブロックされました。"
              elif reason == genai.types.FinishReason.RECITATION: return "回答が引用制限によりブロックされました。"
              else: return f"回答を生成できませんでした。{error_detail}"
+    except genai.types.BlockedPromptException as e:
+        st.session_state.qa_chat_session = None
+        st.error(f"Gemini チャットエラー: 質問がブロックされました。{e}", icon="🚨")
+        return "回答が安全基準によりブロックされました。"
+    except genai.types.StopCandidateException as e:
+        st.session_state.qa_chat_session = None
+        reason = e.args[0].finish_reason if e.args and hasattr(e.args[0], 'finish_reason') else None
+        st.error(f"Gemini チャットエラー: 応答が中断されました。Reason: {reason}", icon="🚨")
+        if reason == genai.types.FinishReason.SAFETY: return "回答が安全基準によりブロックされました。"
+        elif reason == genai.types.FinishReason.RECITATION: return "回答が引用制限によりブロックされました。"
+        else: return f"回答を生成できませんでした。Reason: {reason}"
     except Exception as e:
+        st.session_state.qa_chat_session = None
         st.error(f"Gemini チャットエラーが発生しました: {type(e).__name__} - {e}", icon="🚨")
         st.error("詳細なエラー情報:")
         st.code(traceback.format_exc()) # トレースバックを表示
@@ -199,24 +344,35 @@ def get_gemini_chat_response(context, history, user_question):
 # --- Citation Helper Functions ---
 def extract_citations(ai_response_text):
     citations = []
-    match = re.search(r"【引用元:\s*(.+?)\s*】", ai_response_text)
+    match = _CITATION_BLOCK_RE.search(ai_response_text)
     if match:
         source_text = match.group(1).strip()
         if source_text != "なし":
-            potential_articles = re.findall(r"(?:第(?:[一二三四五六七八九十百千]+|[0-9]+)(?:条(?:の[一二三四五六七八九十百千]|[0-9]+)*)?)", source_text)
+            potential_articles = _ARTICLE_TOKEN_RE.findall(source_text)
             citations.extend(potential_articles)
     return citations
 
-def find_article_text(full_law_text, article_title):
+def build_article_index(full_law_text):
+    """Maps each article title to its text (up to the next article title or end of text)."""
+    if not full_law_text: return {}
+    matches = list(_ARTICLE_TOKEN_RE.finditer(full_law_text)); index = {}
+    for i, m in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(full_law_text)
+        index.setdefault(m.group(0), full_law_text[m.start():end].strip()) # 最初の出現を優先 (従来の re.search と同じ)
+    return index
+
+def find_article_text(full_law_text, article_title, article_index=None):
     if not full_law_text or not article_title: return None
+    if article_index and article_title in article_index: return article_index[article_title]
     # Ensure article_title is treated as literal string in regex
     escaped_title = re.escape(article_title)
     # Regex to find the article title and capture everything until the next article title or end of string
     # (?:\s*\n)* allows for optional whitespace/newlines after the title
     # Using non-greedy match .*?
     # Lookahead (?=...) for the next article title or end of string (\Z)
-    pattern_str = rf"({escaped_title}(?:\s*\n)*.*?)(?=第(?:[一二三四五六七八九十百千]+|[0-9]+)(?:条(?:の[一二三四五六七八九十百千]|[0-9]+)*)?|\Z)"
-    match = re.search(pattern_str, full_law_text, re.DOTALL)
+    # The lookahead body reuses the precompiled article-token pattern
+    pattern = re.compile(rf"({escaped_title}(?:\s*\n)*.*?)(?={_ARTICLE_TOKEN_RE.pattern}|\Z)", re.DOTALL)
+    match = pattern.search(full_law_text)
     if match:
         return match.group(1).strip()
     else: # Fallback: simple find - less accurate for end boundary
@@ -226,17 +382,40 @@ def find_article_text(full_law_text, article_title):
 
 # --- Filtering Function (変更なし) ---
 def filter_laws(laws, name_query, num_query, keyword_query, date_from, date_to):
-    if not laws: return pd.DataFrame()
-    df = pd.DataFrame(laws)
-    if name_query: df = df[df['法令名 (Law Name)'].str.contains(name_query, case=False, na=False)]
-    if num_query: df = df[df['法令番号 (Law Number)'].str.contains(num_query, case=False, na=False)]
-    if keyword_query: df = df[ (df['法令名 (Law Name)'].str.contains(keyword_query, case=False, na=False)) | (df['法令番号 (Law Number)'].str.contains(keyword_query, case=False, na=False)) ]
-    if date_from: df = df[df['公布日 (Promulgation Date)_dt'].notna() & (df['公布日 (Promulgation Date)_dt'] >= date_from)]
-    if date_to: df = df[df['公布日 (Promulgation Date)_dt'].notna() & (df['公布日 (Promulgation Date)_dt'] <= date_to)]
-    df['法令種別 (Law Type)'] = df['法令種別コード (Law Type Code)'].map(LAW_TYPES_REV).fillna("不明")
-    final_cols = [ "LawId", "法令名 (Law Name)", "法令番号 (Law Number)", "公布日 (Promulgation Date)_dt", "法令種別 (Law Type)", TYPE_SORT_KEY ]
-    df_filtered = df[[col for col in final_cols if col in df.columns]].copy()
-    return df_filtered
+    if not count_laws(laws): return pd.DataFrame()
+    df = pd.DataFrame(laws, columns=LAW_LIST_COLUMNS)
+    df['法令種別コード (Law Type Code)'] = df['法令種別コード (Law Type Code)'].astype(_TYPE_CODE_DTYPE)
+    df['公布日 (Promulgation Date)_dt'] = pd.to_datetime(df['公布日 (Promulgation Date)_dt'], format="%Y%m%d", errors="coerce")
+    # 条件はひとつのブールマスクにまとめ、最後に一度だけ行を抽出する (クエリはリテラルとして部分一致)
+    names = df['法令名 (Law Name)']; numbers = df['法令番号 (Law Number)']; dates = df['公布日 (Promulgation Date)_dt']
+    mask = pd.Series(True, index=df.index)
+    if name_query: mask &= names.str.contains(name_query, case=False, na=False, regex=False)
+    if num_query: mask &= numbers.str.contains(num_query, case=False, na=False, regex=False)
+    if keyword_query: mask &= names.str.contains(keyword_query, case=False, na=False, regex=False) | numbers.str.contains(keyword_query, case=False, na=False, regex=False)
+    if date_from: mask &= dates >= pd.Timestamp(date_from) # NaT は比較で False になる
+    if date_to: mask &= dates <= pd.Timestamp(date_to)
+    final_cols = [ "LawId", "法令名 (Law Name)", "法令番号 (Law Number)", "公布日 (Promulgation Date)_dt" ]
+    df_filtered = df.loc[mask, final_cols].copy()
+    type_codes = df.loc[mask, '法令種別コード (Law Type Code)'] # 抽出後の行だけを変換 (カテゴリの付け替えのみで要素ごとの辞書引きは不要)
+    df_filtered['法令種別 (Law Type)'] = type_codes.cat.rename_categories(_LAW_TYPE_LABELS)
+    df_filtered[TYPE_SORT_KEY] = type_codes.cat.codes
+    df_filtered['公布日 (Promulgation Date)'] = df_filtered['公布日 (Promulgation Date)_dt'].dt.strftime('%Y-%m-%d').fillna("N/A") # 表示用文字列を一括生成
+    return df_filtered.reset_index(drop=True) # 行ラベル = 位置 (compute_sort_orders の前提)
+
+def compute_sort_orders(df):
+    """Precomputes ascending row positions (NA last) and the non-NA count for each sortable column."""
+    sort_orders = {}
+    for key in list(BASE_SORTABLE_COLUMNS.values()) + [TYPE_SORT_KEY]:
+        if key not in df.columns: continue
+        order = df[key].sort_values(kind="stable", na_position="last").index.to_numpy()
+        sort_orders[key] = (order, int(df[key].notna().sum()))
+    return sort_orders
+
+def sorted_positions(sort_order, ascending):
+    # 降順は NA 以外の部分だけを反転し、NA は従来どおり末尾に残す
+    order, num_valid = sort_order
+    if ascending: return order
+    return np.concatenate([order[:num_valid][::-1], order[num_valid:]])
 
 
 # --- Streamlit UI ---
@@ -257,6 +436,7 @@ if date_from and date_to and date_from > date_to: st.sidebar.error("Error: 'From
 else: search_clicked = st.sidebar.button("検索実行 (Search)")
 if 'search_results_raw' not in st.session_state: st.session_state.search_results_raw = None
 if 'filtered_results_df' not in st.session_state: st.session_state.filtered_results_df = pd.DataFrame()
+if 'sort_orders' not in st.session_state: st.session_state.sort_orders = {}
 current_selection_code_init = LAW_TYPES.get(st.session_state.get('selected_law_type_name', "すべて (All)"), '1'); current_default_sort_col_init = DEFAULT_ALL_TYPE_SORT_COLUMN if current_selection_code_init == '1' else DEFAULT_SPECIFIC_TYPE_SORT_COLUMN; current_default_sort_asc_init = DEFAULT_ALL_TYPE_SORT_ASCENDING if current_selection_code_init == '1' else DEFAULT_SPECIFIC_TYPE_SORT_ASCENDING
 if 'sort_column' not in st.session_state: st.session_state.sort_column = current_default_sort_col_init
 if 'sort_ascending' not in st.session_state: st.session_state.sort_ascending = current_default_sort_asc_init
@@ -266,31 +446,35 @@ if 'summary_loading' not in st.session_state: st.session_state.summary_loading =
 if 'qa_law_id' not in st.session_state: st.session_state.qa_law_id = None;
 if 'qa_law_name' not in st.session_state: st.session_state.qa_law_name = None;
 if 'qa_law_context' not in st.session_state: st.session_state.qa_law_context = None;
+if 'qa_article_index' not in st.session_state: st.session_state.qa_article_index = {}
+if 'qa_chat_session' not in st.session_state: st.session_state.qa_chat_session = None
 if 'qa_chat_history' not in st.session_state: st.session_state.qa_chat_history = [];
 if 'qa_loading' not in st.session_state: st.session_state.qa_loading = False
+if 'prefetched_law_data' not in st.session_state: st.session_state.prefetched_law_data = {}
 
 
 # --- Search Execution (変更なし) ---
 if search_clicked:
-    st.session_state.search_results_raw = None; st.session_state.filtered_results_df = pd.DataFrame(); st.session_state.summarize_law_id = None; st.session_state.current_summary = None; st.session_state.qa_law_id = None; st.session_state.qa_chat_history = []; st.session_state.qa_law_context = None
+    cancel_prefetches() # 前回の検索の先読みが新しい検索の先読みより先に並ばないようにする
+    st.session_state.search_results_raw = None; st.session_state.filtered_results_df = pd.DataFrame(); st.session_state.sort_orders = {}; st.session_state.summarize_law_id = None; st.session_state.current_summary = None; st.session_state.qa_law_id = None; st.session_state.qa_chat_history = []; st.session_state.qa_law_context = None; st.session_state.qa_article_index = {}; st.session_state.qa_chat_session = None
     if law_type_code_selected == '1': st.session_state.sort_column = DEFAULT_ALL_TYPE_SORT_COLUMN; st.session_state.sort_ascending = DEFAULT_ALL_TYPE_SORT_ASCENDING
     else: st.session_state.sort_column = DEFAULT_SPECIFIC_TYPE_SORT_COLUMN; st.session_state.sort_ascending = DEFAULT_SPECIFIC_TYPE_SORT_ASCENDING
     with st.spinner(f"'{st.session_state.selected_law_type_name}' の法令リストを取得・フィルタリング中..."):
         raw_laws = fetch_law_list(law_type_code_selected)
         st.session_state.search_results_raw = raw_laws
-        if raw_laws is not None: filtered_df = filter_laws(raw_laws, name_query, num_query, keyword_query, date_from, date_to); st.session_state.filtered_results_df = filtered_df
+        if raw_laws is not None: filtered_df = filter_laws(raw_laws, name_query, num_query, keyword_query, date_from, date_to); st.session_state.filtered_results_df = filtered_df; st.session_state.sort_orders = compute_sort_orders(filtered_df) # ソート順は検索時に一度だけ計算
         else: st.session_state.filtered_results_df = pd.DataFrame()
 
 # --- Logic to Fetch Data for AI actions (変更なし) ---
 # このブロックで get_gemini_summary が呼ばれる前に、上記の Gemini Interaction Functions セクションで定義されている必要がある
 if st.session_state.summary_loading and st.session_state.summarize_law_id:
      summary_law_id = st.session_state.summarize_law_id
-     law_text, error = fetch_law_data_for_ai(summary_law_id)
+     with st.spinner("法令本文を取得中..."): law_text, error = get_law_text_cached(summary_law_id)
      if error:
          st.session_state.current_summary = f"要約のための本文取得エラー: {error}"
          st.error(st.session_state.current_summary) # Show error immediately
      elif law_text:
-         st.session_state.current_summary = get_gemini_summary(law_text) # ★★★ ここでエラーが発生していた ★★★
+         st.session_state.current_summary = get_gemini_summary(law_text, st.empty()) # 生成中の要約を逐次表示
      else:
          st.session_state.current_summary = "要約対象の法令本文が見つかりませんでした (本文空)。"
      st.session_state.summary_loading = False
@@ -298,7 +482,7 @@ if st.session_state.summary_loading and st.session_state.summarize_law_id:
 
 if st.session_state.qa_loading and st.session_state.qa_law_id:
      qa_law_id_fetch = st.session_state.qa_law_id
-     law_text, error = fetch_law_data_for_ai(qa_law_id_fetch)
+     with st.spinner("法令本文を取得中..."): law_text, error = get_law_text_cached(qa_law_id_fetch)
      if error:
          st.error(f"Q&Aのための本文取得エラー ({qa_law_id_fetch}): {error}")
          st.session_state.qa_law_id = None # Close Q&A section if context fails
@@ -306,6 +490,7 @@ if st.session_state.qa_loading and st.session_state.qa_law_id:
          st.rerun()
      elif law_text:
          st.session_state.qa_law_context = law_text
+         st.session_state.qa_article_index = build_article_index(law_text) # 引用元の検索用に一度だけ条文を索引化
          st.session_state.qa_loading = False
          st.rerun() # Rerun NOW to make context available and display Q&A section
      else:
@@ -334,11 +519,11 @@ if st.session_state.qa_law_id and not st.session_state.qa_loading:
                 with st.chat_message(message["role"]):
                     st.markdown(message["content"])
                     if message["role"] == "assistant":
-                        citations = extract_citations(message["content"])
+                        citations = message.get("citations", []); cited_texts = message.get("cited_texts", {}) # 回答生成時に一度だけ抽出済み
                         if citations:
                             with st.expander("引用元条文（AIによる推定）", expanded=False):
                                 for cited_article_title in citations:
-                                    cited_text = find_article_text(st.session_state.qa_law_context, cited_article_title)
+                                    cited_text = cited_texts.get(cited_article_title)
                                     if cited_text: st.caption(f"--- {cited_article_title} ---"); st.text(cited_text); st.caption("---")
                                     else: st.warning(f"引用元「{cited_article_title}」の本文をコンテキスト内から見つけられませんでした。")
                                 st.caption("※AIが示した引用元であり、正確性は保証されません。")
@@ -348,11 +533,13 @@ if st.session_state.qa_law_id and not st.session_state.qa_loading:
                 with st.chat_message("assistant"):
                     message_placeholder = st.empty()
                     with st.spinner("AIが回答生成中..."):
-                        response_text = get_gemini_chat_response(st.session_state.qa_law_context, st.session_state.qa_chat_history[:-1], prompt)
+                        response_text = get_gemini_chat_response(st.session_state.qa_law_context, st.session_state.qa_chat_history[:-1], prompt, message_placeholder)
                         message_placeholder.markdown(response_text)
-                st.session_state.qa_chat_history.append({"role": "assistant", "content": response_text})
+                citations = extract_citations(response_text)
+                cited_texts = {c: find_article_text(st.session_state.qa_law_context, c, st.session_state.qa_article_index) for c in citations}
+                st.session_state.qa_chat_history.append({"role": "assistant", "content": response_text, "citations": citations, "cited_texts": cited_texts})
                 st.rerun()
-        if st.button("チャットを終了", key="close_qa"): st.session_state.qa_law_id = None; st.session_state.qa_law_name = None; st.session_state.qa_law_context = None; st.session_state.qa_chat_history = []; st.rerun()
+        if st.button("チャットを終了", key="close_qa"): st.session_state.qa_law_id = None; st.session_state.qa_law_name = None; st.session_state.qa_law_context = None; st.session_state.qa_article_index = {}; st.session_state.qa_chat_session = None; st.session_state.qa_chat_history = []; st.rerun()
 
 
 # --- Display Search Results (変更なし) ---
@@ -376,36 +563,38 @@ if not results_df.empty:
         active_search_code = LAW_TYPES.get(st.session_state.selected_law_type_name, '1'); reset_target_col = DEFAULT_ALL_TYPE_SORT_COLUMN if active_search_code == '1' else DEFAULT_SPECIFIC_TYPE_SORT_COLUMN; reset_target_asc = DEFAULT_ALL_TYPE_SORT_ASCENDING if active_search_code == '1' else DEFAULT_SPECIFIC_TYPE_SORT_ASCENDING
         if st.button("デフォルト順序", key="reset_sort", use_container_width=True, help="ソート順をデフォルトに戻します。"): st.session_state.sort_column = reset_target_col; st.session_state.sort_ascending = reset_target_asc; st.rerun()
     sort_col_key = st.session_state.sort_column; sorted_df = results_df
-    if sort_col_key in results_df.columns:
-        try: sorted_df = results_df.sort_values(by=sort_col_key, ascending=st.session_state.sort_ascending, na_position='last')
+    sort_orders = st.session_state.sort_orders
+    if sort_col_key in sort_orders:
+        try: sorted_df = results_df.iloc[sorted_positions(sort_orders[sort_col_key], st.session_state.sort_ascending)]
         except Exception as e: st.error(f"ソートエラー: {e}")
     else:
         active_search_code = LAW_TYPES.get(st.session_state.selected_law_type_name, '1'); fallback_sort_col = DEFAULT_ALL_TYPE_SORT_COLUMN if active_search_code == '1' else DEFAULT_SPECIFIC_TYPE_SORT_COLUMN; fallback_sort_asc = DEFAULT_ALL_TYPE_SORT_ASCENDING if active_search_code == '1' else DEFAULT_SPECIFIC_TYPE_SORT_ASCENDING
-        if fallback_sort_col in results_df.columns: sorted_df = results_df.sort_values(by=fallback_sort_col, ascending=fallback_sort_asc, na_position='last')
+        if fallback_sort_col in sort_orders: sorted_df = results_df.iloc[sorted_positions(sort_orders[fallback_sort_col], fallback_sort_asc)]
         else: st.warning(f"デフォルトソート列 '{fallback_sort_col}' が見つかりません。")
 
+    if GEMINI_ENABLED: prefetch_law_data(sorted_df["LawId"].head(PREFETCH_TOP_N).dropna().tolist()) # 閲覧中に上位行の本文を先読み
     st.divider(); data_column_ratios = [3, 2, 1.5, 1.5, 1.5]; cols_to_display_base = ["法令名 (Law Name)", "法令番号 (Law Number)", "公布日 (Promulgation Date)", "法令種別 (Law Type)"]
-    for index, row in sorted_df.iterrows():
-        display_cols = st.columns(data_column_ratios); col_idx = 0; law_id = row.get("LawId"); law_name_text = row.get("法令名 (Law Name)", "N/A")
+    # itertuples で行を軽量な namedtuple として回すため、表示に使う列だけを識別子名に付け替える
+    display_df = sorted_df[list(DISPLAY_ROW_FIELDS)].rename(columns=DISPLAY_ROW_FIELDS)
+    # ボタンの無効化判定に使う状態はループ前に一度だけ読み出す
+    s_loading = st.session_state.summary_loading; s_law_id = st.session_state.summarize_law_id; q_loading = st.session_state.qa_loading; q_law_id = st.session_state.qa_law_id
+    for row in display_df.itertuples(index=True, name="LawRow"):
+        index = row.Index; display_cols = st.columns(data_column_ratios); col_idx = 0; law_id = row.law_id; law_name_text = row.law_name or "N/A"
         if law_id and law_name_text != "N/A": link_url = f"{EGOV_LAW_VIEW_URL}{law_id}"; display_name = law_name_text.replace('"', '"'); link_html = f'<a href="{link_url}" target="_blank" rel="noopener noreferrer" title="e-Govで開く: {display_name}">{display_name}</a>'; display_cols[col_idx].markdown(link_html, unsafe_allow_html=True)
         else: display_cols[col_idx].write(law_name_text)
-        col_idx += 1; display_cols[col_idx].write(row.get("法令番号 (Law Number)", "N/A")); col_idx += 1
-        date_obj = row.get("公布日 (Promulgation Date)_dt")
-        if pd.notna(date_obj) and isinstance(date_obj, (datetime, date, pd.Timestamp)):
-            try: display_cols[col_idx].write(date_obj.strftime('%Y-%m-%d'))
-            except ValueError: display_cols[col_idx].write("Date Format Error")
-        else: display_cols[col_idx].write("N/A")
-        col_idx += 1; display_cols[col_idx].write(row.get("法令種別 (Law Type)", "N/A")); col_idx += 1
+        col_idx += 1; display_cols[col_idx].write(row.law_no or "N/A"); col_idx += 1
+        display_cols[col_idx].write(row.date)
+        col_idx += 1; display_cols[col_idx].write(row.law_type if pd.notna(row.law_type) else "N/A"); col_idx += 1
         with display_cols[col_idx]:
             sub_cols = st.columns(1)
             with sub_cols[0]:
                  if GEMINI_ENABLED and law_id:
-                      button_key_summary = f"summary_{law_id}_{index}"; disable_summary = (st.session_state.summary_loading and st.session_state.summarize_law_id == law_id) or (st.session_state.qa_loading and st.session_state.qa_law_id == law_id) or (st.session_state.summarize_law_id == law_id and not st.session_state.summary_loading)
+                      button_key_summary = f"summary_{law_id}_{index}"; disable_summary = (s_loading and s_law_id == law_id) or (q_loading and q_law_id == law_id) or (s_law_id == law_id and not s_loading)
                       if st.button("要約", key=button_key_summary, help="この法令のAI要約を表示します。", use_container_width=True, disabled=disable_summary): st.session_state.qa_law_id = None; st.session_state.qa_chat_history = []; st.session_state.summarize_law_id = law_id; st.session_state.current_summary = None; st.session_state.summary_loading = True; st.rerun()
             with sub_cols[0]:
                 if GEMINI_ENABLED and law_id:
-                    button_key_qa = f"qa_{law_id}_{index}"; disable_qa = (st.session_state.summary_loading and st.session_state.summarize_law_id == law_id) or (st.session_state.qa_loading and st.session_state.qa_law_id == law_id) or (st.session_state.qa_law_id == law_id and not st.session_state.qa_loading)
-                    if st.button("質問", key=button_key_qa, help="この法令についてAIに質問します。", use_container_width=True, disabled=disable_qa): st.session_state.summarize_law_id = None; st.session_state.current_summary = None; st.session_state.qa_law_id = law_id; st.session_state.qa_law_name = law_name_text; st.session_state.qa_chat_history = []; st.session_state.qa_law_context = None; st.session_state.qa_loading = True; st.rerun()
+                    button_key_qa = f"qa_{law_id}_{index}"; disable_qa = (s_loading and s_law_id == law_id) or (q_loading and q_law_id == law_id) or (q_law_id == law_id and not q_loading)
+                    if st.button("質問", key=button_key_qa, help="この法令についてAIに質問します。", use_container_width=True, disabled=disable_qa): st.session_state.summarize_law_id = None; st.session_state.current_summary = None; st.session_state.qa_law_id = law_id; st.session_state.qa_law_name = law_name_text; st.session_state.qa_chat_history = []; st.session_state.qa_law_context = None; st.session_state.qa_article_index = {}; st.session_state.qa_chat_session = None; st.session_state.qa_loading = True; st.rerun()
         st.divider()
 elif search_clicked and st.session_state.filtered_results_df.empty:
     if st.session_state.search_results_raw is None: st.warning("法令リストの取得に失敗したか、中断されました。APIエラーを確認してください。")